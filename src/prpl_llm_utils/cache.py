@@ -1,15 +1,76 @@
 """Methods for saving and loading model responses."""
 
 import abc
+import atexit
+import copy
+import hashlib
 import json
 import logging
+import os
 import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any
 
 import imagehash
+import PIL.Image
 
 from prpl_llm_utils.structs import Query, Response
 
+try:
+    import orjson
+
+    _HAS_ORJSON = True
+except ImportError:  # pragma: no cover
+    _HAS_ORJSON = False
+
+_MAX_IMAGE_WRITE_WORKERS = 8
+
+
+def _save_jpeg(img: PIL.Image.Image, path: Path) -> None:
+    """Save an image as a JPEG with a single, non-progressive encoding pass."""
+    # JPEG does not support transparency or palettes.
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    img.save(path, "JPEG", quality=85, optimize=False, progressive=False)
+
+
+def _copy_response(response: Response) -> Response:
+    """Copy a response so that callers cannot change a cached one."""
+    return Response(response.text, copy.deepcopy(response.metadata))
+
+
+def _dump_json(obj: Any) -> bytes:
+    """Serialize to UTF-8 JSON, using orjson if it is installed.
+
+    The output is the same as with stdlib json, which is used for
+    anything that orjson handles differently.
+    """
+    if _HAS_ORJSON:
+        try:
+            data = orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            # E.g., integers that do not fit in 64 bits.
+            data = None
+        # orjson writes NaN and infinity as null, while stdlib json keeps them.
+        if data is not None and b"null" not in data:
+            return data
+    return json.dumps(obj).encode("utf-8")
+
+
+def _load_json(data: bytes | str) -> Any:
+    """Deserialize JSON, using orjson if it is installed."""
+    if _HAS_ORJSON:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # E.g., NaN and infinity, which stdlib json accepts. Corrupted
+            # data still raises below.
+            pass
+    return json.loads(data)
+
 
 class ResponseNotFound(Exception):
     """Raised during cache lookup if a response is not found."""
@@ -28,58 +89,137 @@ class PretrainedLargeModelCache(abc.ABC):
 
 
 class FilePretrainedLargeModelCache(PretrainedLargeModelCache):
-    """A cache that saves and loads from individual files."""
-
-    def __init__(self, cache_dir: Path) -> None:
+    """A cache that saves and loads from individual files.
+
+    By default, every saved response is written to disk immediately. If
+    max_pending is greater than 1, saved responses are instead buffered
+    in memory and written in batches, either when max_pending responses
+    are buffered, when a response is saved at least flush_interval
+    seconds after the last write, when flush() is called, or when the
+    interpreter exits.
+
+    The most recently used max_memory_entries responses are also kept in
+    memory, so repeated lookups do not need to read from disk.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        max_pending: int = 1,
+        flush_interval: float = 5.0,
+        max_memory_entries: int = 1024,
+    ) -> None:
         self._cache_dir = cache_dir
         self._cache_dir.mkdir(exist_ok=True)
+        self._max_pending = max_pending
+        self._flush_interval = flush_interval
+        self._max_memory_entries = max_memory_entries
+        self._pending: dict[Path, tuple[Query, Response]] = {}
+        self._memory: OrderedDict[Path, Response] = OrderedDict()
+        self._last_flush_time = time.monotonic()
+        # Only hold on to the pending responses, not the whole cache, so that
+        # the cache and its memory layer can be garbage collected.
+        if self._max_pending > 1:
+            atexit.register(_flush_pending, self._pending)
 
     def _get_cache_dir_for_query(self, query: Query, model_id: str) -> Path:
-        query_id = query.get_readable_id()
-        cache_foldername = f"{model_id}_{query_id}"
-        cache_folderpath = self._cache_dir / cache_foldername
-        cache_folderpath.mkdir(exist_ok=True)
-        return cache_folderpath
+        # Use a fixed-length hash so that folder names are always safe, and
+        # shard by the hash prefix to keep the number of entries per folder low.
+        key = f"{model_id}|{query.get_readable_id()}"
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+        return self._cache_dir / digest[:2] / digest[2:]
 
     def try_load_response(self, query: Query, model_id: str) -> Response:
         cache_dir = self._get_cache_dir_for_query(query, model_id)
-        if not (cache_dir / "prompt.txt").exists():
-            raise ResponseNotFound
-        # Load the saved completions.
-        completion_file = cache_dir / "completion.txt"
-        with open(completion_file, "r", encoding="utf-8") as f:
-            completion = f.read()
-        # Load the metadata.
-        metadata_file = cache_dir / "metadata.json"
-        with open(metadata_file, "r", encoding="utf-8") as f:
-            metadata = json.load(f)
+        if cache_dir in self._pending:
+            _, response = self._pending[cache_dir]
+            logging.debug(f"Loaded pending model response for {cache_dir}.")
+            return _copy_response(response)
+        if cache_dir in self._memory:
+            self._memory.move_to_end(cache_dir)
+            logging.debug(f"Loaded model response for {cache_dir} from memory.")
+            return _copy_response(self._memory[cache_dir])
+        # Load the saved prompt, completion, and metadata. A missing file is
+        # the miss signal, which avoids a separate existence check on hits.
+        try:
+            with open(cache_dir / "entry.json", "rb") as f:
+                entry = _load_json(f.read())
+        except FileNotFoundError as e:
+            raise ResponseNotFound from e
+        except ValueError as e:
+            # Treat a corrupted entry (e.g., from an old crash) as a miss, so
+            # that it is overwritten when the new response is saved.
+            logging.warning(f"Ignoring unreadable cache entry in {cache_dir}: {e}")
+            raise ResponseNotFound from e
         # Create the response.
-        response = Response(completion, metadata)
+        response = Response(entry["completion"], entry["metadata"])
+        self._remember(cache_dir, response)
         logging.debug(f"Loaded model response from {cache_dir}.")
         return response
 
     def save(self, query: Query, model_id: str, response: Response) -> None:
         cache_dir = self._get_cache_dir_for_query(query, model_id)
-        # Cache the text prompt.
-        prompt_file = cache_dir / "prompt.txt"
-        with open(prompt_file, "w", encoding="utf-8") as f:
-            f.write(query.prompt)
-        # Cache the image prompt if it exists.
-        if query.imgs is not None:
-            imgs_folderpath = cache_dir / "imgs"
-            imgs_folderpath.mkdir(exist_ok=True)
-            for i, img in enumerate(query.imgs):
-                filename_suffix = str(i) + ".jpg"
-                img.save(imgs_folderpath / filename_suffix)
-        # Cache the text response.
-        completion_file = cache_dir / "completion.txt"
-        with open(completion_file, "w", encoding="utf-8") as f:
-            f.write(response.text)
-        # Cache the metadata.
-        metadata_file = cache_dir / "metadata.json"
-        with open(metadata_file, "w", encoding="utf-8") as f:
-            json.dump(response.metadata, f)
-        logging.debug(f"Saved model response to {cache_dir}.")
+        self._pending[cache_dir] = (query, _copy_response(response))
+        self._remember(cache_dir, response)
+        if (
+            len(self._pending) >= self._max_pending
+            or time.monotonic() - self._last_flush_time >= self._flush_interval
+        ):
+            self.flush()
+
+    def _remember(self, cache_dir: Path, response: Response) -> None:
+        """Remember a copy of the response, evicting the oldest if needed."""
+        self._memory[cache_dir] = _copy_response(response)
+        self._memory.move_to_end(cache_dir)
+        while len(self._memory) > self._max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def flush(self) -> None:
+        """Write all pending responses to disk."""
+        _flush_pending(self._pending)
+        self._last_flush_time = time.monotonic()
+
+
+def _flush_pending(pending: dict[Path, tuple[Query, Response]]) -> None:
+    """Write the pending responses to disk and clear them."""
+    for cache_dir, (query, response) in pending.items():
+        _write_cache_entry(cache_dir, query, response)
+    pending.clear()
+
+
+def _write_cache_entry(cache_dir: Path, query: Query, response: Response) -> None:
+    """Write one response and its prompt to a cache folder."""
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # Cache the image prompt if it exists.
+    if query.imgs is not None:
+        imgs_folderpath = cache_dir / "imgs"
+        imgs_folderpath.mkdir(exist_ok=True)
+        img_paths = [imgs_folderpath / f"{i}.jpg" for i in range(len(query.imgs))]
+        # Encoding releases the GIL, so save multiple images in parallel.
+        if len(query.imgs) > 1:
+            max_workers = min(len(query.imgs), _MAX_IMAGE_WRITE_WORKERS)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(_save_jpeg, query.imgs, img_paths))
+        else:
+            for img, img_path in zip(query.imgs, img_paths, strict=True):
+                _save_jpeg(img, img_path)
+    # Cache the text prompt, text response, and metadata in one file.
+    entry = {
+        "prompt": query.prompt,
+        "completion": response.text,
+        "metadata": response.metadata,
+    }
+    # Write to a temporary file first and then rename it, so that a crash
+    # never leaves a partially written entry behind.
+    tmp_file = cache_dir / f"entry.json.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "wb") as f:
+            f.write(_dump_json(entry))
+        os.replace(tmp_file, cache_dir / "entry.json")
+    except BaseException:
+        tmp_file.unlink(missing_ok=True)
+        raise
+    logging.debug(f"Saved model response to {cache_dir}.")
 
 
 class SQLite3PretrainedLargeModelCache(PretrainedLargeModelCache):
@@ -154,7 +294,7 @@ class SQLite3PretrainedLargeModelCache(PretrainedLargeModelCache):
                 raise ResponseNotFound
 
             completion, metadata_json = result
-            metadata = json.loads(metadata_json)
+            metadata = _load_json(metadata_json)
             response = Response(completion, metadata)
             logging.debug(
                 f"Loaded model response from SQLite for query hash {query_hash}."
@@ -171,7 +311,7 @@ class SQLite3PretrainedLargeModelCache(PretrainedLargeModelCache):
             img_hash_list = [str(imagehash.phash(img)) for img in query.imgs]
             images_hash = json.dumps(img_hash_list)
 
-        metadata_json = json.dumps(response.metadata)
+        metadata_json = _dump_json(response.metadata).decode("utf-8")
 
         # Build base columns and values.
         columns = [
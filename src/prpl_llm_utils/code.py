@@ -1,17 +1,21 @@
 """Data structure and methods for code synthesis."""
 
 import ast
-import importlib
+import contextlib
+import hashlib
+import linecache
 import multiprocessing as mp
 import os
+import pickle
 import signal
 import sys
-import tempfile
+import time
 import traceback
+from collections import OrderedDict
 from dataclasses import dataclass
 from functools import cached_property
-from pathlib import Path
-from typing import Any, Callable
+from types import ModuleType
+from typing import Any, Callable, Generator, Sequence
 
 from prpl_llm_utils.models import PretrainedLargeModel
 from prpl_llm_utils.reprompting import (
@@ -29,6 +33,86 @@ class SynthesizedPythonFunctionRunError(Exception):
     """An exception raised during a call to SynthesizedPythonFunction.run()."""
 
 
+# Synthesized modules by code string, in least-recently-used order.
+_MAX_SYNTHESIZED_MODULES = 128
+_SYNTHESIZED_MODULES: OrderedDict[str, ModuleType] = OrderedDict()
+
+
+# Pickled outputs of synthesized functions by code string, function name, and
+# pickled inputs, in least-recently-used order.
+_MAX_MEMOIZED_OUTPUTS = 1024
+_MEMOIZED_OUTPUTS: OrderedDict[tuple[str, str, bytes], bytes] = OrderedDict()
+
+# The most runs of a synthesized function that are in progress at once.
+_MAX_PARALLEL_RUNS = os.cpu_count() or 1
+
+
+def _compile_module(code_str: str) -> ModuleType:
+    """Compile and execute the code string in a fresh in-memory module.
+
+    The result only depends on the code string, so identical code (e.g.,
+    regenerated during reprompting) is only compiled once per process.
+    """
+    if code_str in _SYNTHESIZED_MODULES:
+        module = _SYNTHESIZED_MODULES[code_str]
+        _register_module(code_str, module)
+        return module
+    digest = hashlib.blake2b(code_str.encode("utf-8"), digest_size=8)
+    module_name = f"synthesized_{digest.hexdigest()}"
+    filename = f"<{module_name}>"
+    code = compile(code_str, filename, "exec")
+    module = ModuleType(module_name)
+    module.__file__ = filename
+    # Needed before execution, e.g., for dataclasses to resolve the module.
+    _register_module(code_str, module)
+    try:
+        exec(code, module.__dict__)  # pylint: disable=exec-used
+    except BaseException:
+        del _SYNTHESIZED_MODULES[code_str]
+        del sys.modules[module_name]
+        raise
+    return module
+
+
+def _register_module(code_str: str, module: ModuleType) -> None:
+    """Register a synthesized module in sys.modules as the most recently used.
+
+    The module must be in sys.modules whenever outputs are pickled,
+    e.g., instances of classes that are defined in the synthesized code.
+    Only the most recently used modules stay registered, so call this
+    before every use. Evicted modules can then be garbage collected once
+    no SynthesizedPythonFunction refers to them.
+    """
+    _SYNTHESIZED_MODULES[code_str] = module
+    _SYNTHESIZED_MODULES.move_to_end(code_str)
+    sys.modules[module.__name__] = module
+    # Register the source so that tracebacks (which are used in reprompts)
+    # still show the offending lines even though there is no file on disk.
+    assert module.__file__ is not None
+    linecache.cache[module.__file__] = (
+        len(code_str),
+        None,
+        code_str.splitlines(keepends=True),
+        module.__file__,
+    )
+    while len(_SYNTHESIZED_MODULES) > _MAX_SYNTHESIZED_MODULES:
+        _, evicted_module = _SYNTHESIZED_MODULES.popitem(last=False)
+        sys.modules.pop(evicted_module.__name__, None)
+        assert evicted_module.__file__ is not None
+        linecache.cache.pop(evicted_module.__file__, None)
+
+
+def _memoize_output(key: tuple[str, str, bytes], fn_output: Any) -> None:
+    """Store a pickled copy of a synthesized function output."""
+    try:
+        _MEMOIZED_OUTPUTS[key] = pickle.dumps(fn_output)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return
+    _MEMOIZED_OUTPUTS.move_to_end(key)
+    while len(_MEMOIZED_OUTPUTS) > _MAX_MEMOIZED_OUTPUTS:
+        _MEMOIZED_OUTPUTS.popitem(last=False)
+
+
 @dataclass(frozen=True)
 class SynthesizedPythonFunction:
     """Wraps a piece of Python code that contains a function with a given name.
@@ -38,30 +122,26 @@ class SynthesizedPythonFunction:
     calling run().
 
     If timeout is exceeded on run() call, a TimeoutError is raised.
+
+    If memoize is True, the function is assumed to be deterministic, and
+    outputs for previously seen inputs are reused, including across
+    instances with the same code. Each call returns a fresh copy.
     """
 
     function_name: str
     code_str: str
     timeout: float = 30.0  # max time in seconds that run() is allowed
+    memoize: bool = False
 
     @cached_property
-    def filepath(self) -> Path:
-        """Get a file with the code string implemented in it."""
-        filename = Path(tempfile.NamedTemporaryFile(delete=False, suffix=".py").name)
-        with open(filename, "w", encoding="utf-8") as f:
-            f.write(self.code_str)
-        return filename
-
-    def _load_module(self) -> Any:
-        module_name = f"{self.filepath.stem}"
-        spec = importlib.util.spec_from_file_location(module_name, self.filepath)
-        assert spec is not None
-        assert spec.loader is not None
-        module = importlib.util.module_from_spec(spec)
-        assert module is not None
-        sys.modules[module_name] = module
-        spec.loader.exec_module(module)
-        return module
+    def _module(self) -> ModuleType:
+        """Load the module once."""
+        return _compile_module(self.code_str)
+
+    @cached_property
+    def _fn(self) -> Callable[..., Any]:
+        """Resolve the function from the module once."""
+        return getattr(self._module, self.function_name)
 
     def __call__(self, *input_args: Any) -> Any:
         """Alias for run()."""
@@ -72,8 +152,57 @@ class SynthesizedPythonFunction:
 
     def run(self, *input_args: Any) -> Any:
         """Run the function on an input (that will be unpacked)."""
-        module = self._load_module()
-        fn = getattr(module, self.function_name)
+        return list(self.run_many([input_args]))[0]
+
+    def run_many(
+        self, all_input_args: Sequence[Sequence[Any]]
+    ) -> Generator[Any, None, None]:
+        """Run the function on multiple inputs (that will be unpacked) in
+        parallel and yield the outputs in order.
+
+        At most one run per CPU is in progress at once, and each run has
+        its own timeout starting from when it starts. If a run fails,
+        the error is raised in place of its output and any other runs
+        that are still in progress are stopped.
+        """
+        # The module may have been evicted since this function was loaded.
+        _register_module(self.code_str, self._module)
+        input_tuples = [tuple(input_args) for input_args in all_input_args]
+        memo_keys = [self._get_memo_key(input_args) for input_args in input_tuples]
+        memoized_outputs: dict[int, bytes] = {}
+        for i, key in enumerate(memo_keys):
+            if key is not None and key in _MEMOIZED_OUTPUTS:
+                _MEMOIZED_OUTPUTS.move_to_end(key)
+                memoized_outputs[i] = _MEMOIZED_OUTPUTS[key]
+        to_run = [a for i, a in enumerate(input_tuples) if i not in memoized_outputs]
+        new_outputs = self._run_in_subprocesses(to_run)
+        with contextlib.closing(new_outputs):
+            for i, key in enumerate(memo_keys):
+                if i in memoized_outputs:
+                    # Unpickle a copy so that callers cannot mutate the memo.
+                    yield pickle.loads(memoized_outputs[i])
+                    continue
+                fn_output = next(new_outputs)  # pylint: disable=stop-iteration-return
+                if key is not None:
+                    _memoize_output(key, fn_output)
+                yield fn_output
+
+    def _get_memo_key(self, input_args: tuple) -> tuple[str, str, bytes] | None:
+        if not self.memoize:
+            return None
+        # Pickling also distinguishes inputs that are equal, like 1 and True.
+        try:
+            return (self.code_str, self.function_name, pickle.dumps(input_args))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return None
+
+    def _run_in_subprocesses(
+        self, all_input_args: list[tuple]
+    ) -> Generator[Any, None, None]:
+        if not all_input_args:
+            return
+        fn = self._fn
+        function_name = self.function_name
 
         # All of the code below is for handling the possibility of the function
         # call timing out.
@@ -84,32 +213,49 @@ class SynthesizedPythonFunction:
             except BaseException as e:
                 exception_msg = "\n".join(traceback.format_exception(e))
                 error_msg = (
-                    f"Given the input {input_args}, {self.function_name} raised an "
+                    f"Given the input {args}, {function_name} raised an "
                     f"exception:\n{exception_msg}"
                 )
                 result_dict["error_msg"] = error_msg
 
         manager = mp.Manager()
-        result_proxy_dict = manager.dict()
-        p = mp.Process(
-            target=_fn_in_place,
-            args=(result_proxy_dict,) + tuple(input_args),
-        )
-        p.start()
-        p.join(self.timeout)
-        result_dict = dict(result_proxy_dict)
-        # Timeout reached.
-        if p.is_alive():
-            # Treated like a KeyboardInterrupt.
-            assert p.pid is not None
-            os.kill(p.pid, signal.SIGINT)
-            # Give it a few more seconds then kill for good.
-            p.join(3)
-            p.kill()
-            raise SynthesizedPythonFunctionRunError("Possible infinite loop.")
-        if "error_msg" in result_dict:
-            raise SynthesizedPythonFunctionRunError(result_dict["error_msg"])
-        return result_dict["fn_output"]
+        max_parallel_runs = max(_MAX_PARALLEL_RUNS, 1)
+        runs: list[tuple[mp.Process, Any, float]] = []
+        try:
+            for i in range(len(all_input_args)):
+                # Keep up to max_parallel_runs runs in progress, starting each
+                # one (and its timeout) only when there is room for it.
+                while len(runs) < len(all_input_args) and (
+                    len(runs) - i < max_parallel_runs
+                ):
+                    result_proxy_dict = manager.dict()
+                    p = mp.Process(
+                        target=_fn_in_place,
+                        args=(result_proxy_dict,) + all_input_args[len(runs)],
+                    )
+                    p.start()
+                    runs.append((p, result_proxy_dict, time.monotonic()))
+                p, result_proxy_dict, start_time = runs[i]
+                p.join(max(start_time + self.timeout - time.monotonic(), 0.0))
+                result_dict = dict(result_proxy_dict)
+                # Timeout reached.
+                if p.is_alive():
+                    # Treated like a KeyboardInterrupt.
+                    assert p.pid is not None
+                    os.kill(p.pid, signal.SIGINT)
+                    # Give it a few more seconds then kill for good.
+                    p.join(3)
+                    p.kill()
+                    raise SynthesizedPythonFunctionRunError("Possible infinite loop.")
+                if "error_msg" in result_dict:
+                    raise SynthesizedPythonFunctionRunError(result_dict["error_msg"])
+                yield result_dict["fn_output"]
+        finally:
+            # Stop any runs that are still in progress, e.g., after a failure.
+            for p, _, _ in runs:
+                if p.is_alive():
+                    p.kill()
+            manager.shutdown()
 
 
 class SyntaxRepromptCheck(RepromptCheck):
@@ -132,6 +278,10 @@ class FunctionOutputRepromptCheck(RepromptCheck):
     """Check whether the synthesized Python function produces valid output.
 
     It is up to the user of this class how "valid" is defined.
+
+    If memoize is True, the synthesized function is assumed to be
+    deterministic, so outputs are reused whenever a reprompt produces
+    the same code again.
     """
 
     def __init__(
@@ -140,6 +290,7 @@ class FunctionOutputRepromptCheck(RepromptCheck):
         inputs: list[Any],
         output_check_fns: list[Callable[[Any], bool]],
         function_timeout: float = 30.0,
+        memoize: bool = False,
     ) -> None:
         assert len(inputs) == len(
             output_check_fns
@@ -148,43 +299,51 @@ class FunctionOutputRepromptCheck(RepromptCheck):
         self._inputs = inputs
         self._output_check_fns = output_check_fns
         self._function_timeout = function_timeout
+        self._memoize = memoize
 
     def get_reprompt(self, query: Query, response: Response) -> Query | None:
         python_code = parse_python_code_from_text(response.text)
         if python_code is None:
             raise RuntimeError("No python code found. Consider SyntaxRepromptCheck().")
         fn = SynthesizedPythonFunction(
-            self._function_name, python_code, timeout=self._function_timeout
+            self._function_name,
+            python_code,
+            timeout=self._function_timeout,
+            memoize=self._memoize,
         )
-        for fn_in, check_fn in zip(self._inputs, self._output_check_fns, strict=True):
-            try:
-                fn_out = fn.run(*fn_in)
-            except SynthesizedPythonFunctionRunError as e:
-                error_msg = e.args[0]
-                return create_reprompt_from_error_message(query, response, error_msg)
-            if not check_fn(fn_out):
-                error_msg = (
-                    f"Given the input {fn_in}, the output of {self._function_name} "
-                    f"was {fn_out}, which is invalid"
-                )
-                return create_reprompt_from_error_message(query, response, error_msg)
+        # Run all inputs in parallel, but check them in order.
+        fn_outs = fn.run_many(self._inputs)
+        with contextlib.closing(fn_outs):
+            for fn_in, check_fn in zip(
+                self._inputs, self._output_check_fns, strict=True
+            ):
+                try:
+                    fn_out = next(fn_outs)
+                except SynthesizedPythonFunctionRunError as e:
+                    error_msg = e.args[0]
+                    return create_reprompt_from_error_message(
+                        query, response, error_msg
+                    )
+                if not check_fn(fn_out):
+                    error_msg = (
+                        f"Given the input {fn_in}, the output of "
+                        f"{self._function_name} was {fn_out}, which is invalid"
+                    )
+                    return create_reprompt_from_error_message(
+                        query, response, error_msg
+                    )
         return None
 
 
 def parse_python_code_from_text(text: str) -> str | None:
     """Parse Python code from text, assuming ```python tag."""
-    # Parse out python code if it exists.
-    python_code_prefix = "```python"
-    if python_code_prefix in text:
-        python_start = text.index(python_code_prefix)
-        python_remainder = text[python_start + len(python_code_prefix) :]
-        if "```" in python_remainder:
-            python_end = python_remainder.index("```")
-        else:
-            python_end = len(python_remainder)
-        python_response = python_remainder[:python_end]
-        return python_response
-    return None
+    # Parse out python code if it exists. If the closing fence is missing,
+    # everything after the opening tag is assumed to be code.
+    _, python_code_prefix, python_remainder = text.partition("```python")
+    if not python_code_prefix:
+        return None
+    python_response, _, _ = python_remainder.partition("```")
+    return python_response
 
 
 def synthesize_python_function_with_llm(
@@ -1,12 +1,18 @@
 """Interfaces for large language models."""
 
 import abc
+import asyncio
+import concurrent.futures
+import json
 import logging
 import os
-from typing import Hashable
+import time
+from functools import cached_property
+from typing import Any, Hashable
 
 import openai
 import PIL.Image
+from openai.types.chat import ChatCompletion
 
 from prpl_llm_utils.cache import PretrainedLargeModelCache, ResponseNotFound
 from prpl_llm_utils.structs import Query, Response
@@ -57,6 +63,61 @@ class PretrainedLargeModel(abc.ABC):
             self._cache.save(query, model_id, response)
         return response
 
+    def _run_queries(self, queries: list[Query]) -> list[Response | Exception]:
+        """Run multiple queries that are not in the cache.
+
+        Each query gets either its response or the exception that it
+        raised, so one failure does not lose the other responses. By
+        default, the queries are run one at a time. Subclasses can
+        override this to run them concurrently or in batches.
+        """
+        results: list[Response | Exception] = []
+        for query in queries:
+            try:
+                results.append(self._run_query(query))
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                results.append(e)
+        return results
+
+    def run_queries(self, queries: list[Query]) -> list[Response]:
+        """Run multiple built queries, returning responses in the same order.
+
+        Only the queries that are not in the cache are run, and those
+        are run together through _run_queries(). If any of them fail,
+        the successful responses are still cached before an error
+        listing the failed queries is raised.
+        """
+        model_id = self.get_id()
+        responses: dict[Query, Response] = {}
+        uncached_queries: list[Query] = []
+        # Deduplicate the queries while preserving their order.
+        for query in dict.fromkeys(queries):
+            try:
+                responses[query] = self._cache.try_load_response(query, model_id)
+            except ResponseNotFound:
+                if self._use_cache_only:
+                    raise ValueError("No cached response found for prompt.")
+                uncached_queries.append(query)
+        if uncached_queries:
+            logging.debug(
+                f"Querying model {model_id} with {len(uncached_queries)} new prompts."
+            )
+            new_responses = self._run_queries(uncached_queries)
+            failures: list[tuple[Query, Exception]] = []
+            for query, response in zip(uncached_queries, new_responses, strict=True):
+                if isinstance(response, Exception):
+                    failures.append((query, response))
+                    continue
+                self._cache.save(query, model_id, response)
+                responses[query] = response
+            if failures:
+                details = "\n".join(f"  {q.prompt[:80]!r}: {e!r}" for q, e in failures)
+                raise RuntimeError(
+                    f"{len(failures)} of {len(uncached_queries)} queries to model "
+                    f"{model_id} failed:\n{details}"
+                ) from failures[0][1]
+        return [responses[query] for query in queries]
+
     def query(
         self,
         prompt: str,
@@ -84,25 +145,184 @@ class OpenAIModel(PretrainedLargeModel):
     def get_id(self) -> str:
         return self._model_name
 
-    def _run_query(self, query: Query) -> Response:
+    def _get_completion_kwargs(self, query: Query) -> dict[str, Any]:
+        """Get the keyword arguments for a chat completion request."""
         assert not query.imgs, "TODO"
-        client = openai.OpenAI()
         messages = [{"role": "user", "content": query.prompt, "type": "text"}]
         if query.hyperparameters is not None:
-            kwargs = query.hyperparameters
+            kwargs = dict(query.hyperparameters)
         else:
             kwargs = {}
-        completion = client.chat.completions.create(  # type: ignore[call-overload]
-            messages=messages,
-            model=self._model_name,
-            **kwargs,
-        )
+        return {"messages": messages, "model": self._model_name, **kwargs}
+
+    @staticmethod
+    def _completion_to_response(completion: ChatCompletion) -> Response:
         assert len(completion.choices) == 1
         text = completion.choices[0].message.content
+        assert text is not None
         assert completion.usage is not None
         metadata = completion.usage.to_dict()
         return Response(text, metadata)
 
+    @cached_property
+    def _client(self) -> openai.OpenAI:
+        """Get a client that is reused between queries.
+
+        Reusing the client keeps its connections alive.
+        """
+        return openai.OpenAI()
+
+    def _run_query(self, query: Query) -> Response:
+        client = self._client
+        kwargs = self._get_completion_kwargs(query)
+        completion = client.chat.completions.create(  # type: ignore[call-overload]
+            **kwargs
+        )
+        return self._completion_to_response(completion)
+
+
+class AsyncOpenAIModel(OpenAIModel):
+    """An OpenAI model that sends multiple queries concurrently.
+
+    Single queries behave the same as in OpenAIModel. With
+    run_queries(), up to max_concurrent_queries requests are in flight
+    at once, so the total time is close to the slowest request rather
+    than the sum. If run_queries() is called while an event loop is
+    already running (e.g., in Jupyter), the requests are sent from a
+    separate thread with its own event loop.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        cache: PretrainedLargeModelCache,
+        use_cache_only: bool = False,
+        max_concurrent_queries: int = 8,
+    ) -> None:
+        self._max_concurrent_queries = max_concurrent_queries
+        super().__init__(model_name, cache, use_cache_only)
+
+    def _run_queries(self, queries: list[Query]) -> list[Response | Exception]:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self._run_queries_async(queries))
+        # asyncio.run() cannot be called from a running event loop.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(asyncio.run, self._run_queries_async(queries))
+            return future.result()
+
+    async def _run_queries_async(
+        self, queries: list[Query]
+    ) -> list[Response | Exception]:
+        semaphore = asyncio.Semaphore(self._max_concurrent_queries)
+        # The client is bound to the event loop, so create it here.
+        async with openai.AsyncOpenAI() as client:
+            create_completion = client.chat.completions.create
+
+            async def _run_one(query: Query) -> Response:
+                kwargs = self._get_completion_kwargs(query)
+                async with semaphore:
+                    completion = await create_completion(  # type: ignore[call-overload]
+                        **kwargs
+                    )
+                return self._completion_to_response(completion)
+
+            results = await asyncio.gather(
+                *(_run_one(q) for q in queries), return_exceptions=True
+            )
+        responses: list[Response | Exception] = []
+        for result in results:
+            # Let cancellations and interrupts through.
+            if isinstance(result, BaseException) and not isinstance(result, Exception):
+                raise result
+            responses.append(result)
+        return responses
+
+
+class BatchedOpenAIModel(OpenAIModel):
+    """An OpenAI model that sends multiple queries through the Batch API.
+
+    Batches are cheaper than individual requests, but can take a long
+    time (up to 24 hours) to complete, so this is meant for offline
+    workloads like evaluation sweeps. Single queries behave the same as
+    in OpenAIModel; use run_queries() to submit a batch and wait for it.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        cache: PretrainedLargeModelCache,
+        use_cache_only: bool = False,
+        poll_interval: float = 30.0,
+    ) -> None:
+        self._poll_interval = poll_interval
+        super().__init__(model_name, cache, use_cache_only)
+
+    def _run_queries(self, queries: list[Query]) -> list[Response | Exception]:
+        client = self._client
+        # Upload the requests as a JSONL file.
+        lines = []
+        for i, query in enumerate(queries):
+            request = {
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self._get_completion_kwargs(query),
+            }
+            lines.append(json.dumps(request))
+        batch_input = "\n".join(lines).encode("utf-8")
+        input_file = client.files.create(
+            file=("batch.jsonl", batch_input), purpose="batch"
+        )
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        logging.debug(f"Submitted OpenAI batch {batch.id}.")
+        # Wait for the batch to finish.
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(self._poll_interval)
+            batch = client.batches.retrieve(batch.id)
+        if batch.status != "completed":
+            logging.warning(f"OpenAI batch {batch.id} ended as {batch.status}.")
+        # Parse the results, which may be out of order. Expired and cancelled
+        # batches can still have results for the requests that finished.
+        results: dict[int, Response | Exception] = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id is None:
+                continue
+            for line in client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                i = int(result["custom_id"])
+                results[i] = self._batch_result_to_response(result)
+                if isinstance(results[i], Exception):
+                    logging.warning(
+                        f"Request {i} in OpenAI batch {batch.id} failed: {results[i]}"
+                    )
+        for i in range(len(queries)):
+            if i not in results:
+                results[i] = RuntimeError(
+                    f"No result for request {i} in OpenAI batch {batch.id}, "
+                    f"which ended as {batch.status}."
+                )
+        return [results[i] for i in range(len(queries))]
+
+    def _batch_result_to_response(self, result: dict[str, Any]) -> Response | Exception:
+        """Convert one line of a batch output or error file."""
+        if result.get("error") is not None:
+            return RuntimeError(f"Batch request failed: {result['error']}")
+        status_code = result["response"]["status_code"]
+        body = result["response"]["body"]
+        if status_code != 200:
+            return RuntimeError(
+                f"Batch request failed with status {status_code}: {body}"
+            )
+        return self._completion_to_response(ChatCompletion.model_validate(body))
+
 
 class CannedResponseModel(PretrainedLargeModel):
     """A model that returns responses from a dictionary and raises an error if
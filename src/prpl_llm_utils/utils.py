@@ -6,10 +6,46 @@ from typing import Any
 
 def consistent_hash(obj: Any) -> int:
     """A hash function that is consistent between sessions, unlike hash()."""
-    obj_str = repr(obj)
-    obj_bytes = obj_str.encode("utf-8")
-    hash_hex = hashlib.sha256(obj_bytes).hexdigest()
-    hash_int = int(hash_hex, 16)
+    hasher = hashlib.blake2b(digest_size=8)
+    _update_hash(hasher, obj)
+    digest = hasher.digest()
     # Mimic Python's built-in hash() behavior by returning a 64-bit signed int.
     # This makes it comparable to hash()'s output range.
-    return hash_int if hash_int < 2**63 else hash_int - 2**6
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def _update_hash(hasher: hashlib.blake2b, obj: Any) -> None:
+    """Stream a serialization of the object into the hasher.
+
+    Each value is tagged with its type (and length, for sequences) so
+    that different structures cannot produce the same bytes. Unknown
+    types fall back to repr().
+    """
+    if isinstance(obj, str):
+        _update_hash_with_bytes(hasher, b"s", obj.encode("utf-8"))
+    elif isinstance(obj, bytes):
+        _update_hash_with_bytes(hasher, b"b", obj)
+    elif obj is None:
+        hasher.update(b"N")
+    elif isinstance(obj, bool):
+        hasher.update(b"T" if obj else b"F")
+    elif isinstance(obj, int):
+        hasher.update(b"i%d;" % obj)
+    elif isinstance(obj, float):
+        hasher.update(b"f" + repr(obj).encode("utf-8") + b";")
+    elif isinstance(obj, (tuple, list)):
+        hasher.update((b"t" if isinstance(obj, tuple) else b"l") + b"%d:" % len(obj))
+        for item in obj:
+            _update_hash(hasher, item)
+    elif isinstance(obj, dict):
+        hasher.update(b"d%d:" % len(obj))
+        for key, value in obj.items():
+            _update_hash(hasher, key)
+            _update_hash(hasher, value)
+    else:
+        _update_hash_with_bytes(hasher, b"r", repr(obj).encode("utf-8"))
+
+
+def _update_hash_with_bytes(hasher: hashlib.blake2b, tag: bytes, data: bytes) -> None:
+    hasher.update(tag + b"%d:" % len(data))
+    hasher.update(data)
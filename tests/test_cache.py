@@ -1,10 +1,15 @@
 """Tests for cache implementations."""
 
+import gc
+import math
 import tempfile
+import weakref
 from pathlib import Path
 
+import PIL.Image
 import pytest
 
+from prpl_llm_utils import cache as cache_module
 from prpl_llm_utils.cache import (
     FilePretrainedLargeModelCache,
     ResponseNotFound,
@@ -33,6 +38,144 @@ def test_file_cache():
         cache.try_load_response(Query("Different query"), "test-model")
 
 
+def test_file_cache_corrupted_entry():
+    """Tests that FilePretrainedLargeModelCache() recovers from a bad entry."""
+    cache_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+    cache_path = Path(cache_dir.name)
+    cache = FilePretrainedLargeModelCache(cache_path)
+    query = Query("Hello!")
+    cache.save(query, "test-model", Response("Hi there!", {"tokens": 5}))
+    # Entries are written atomically, so no temporary files are left behind.
+    assert [p.name for p in cache_path.glob("*/*/*")] == ["entry.json"]
+
+    # Simulate an entry that was truncated by a crash in an older version.
+    (entry_file,) = cache_path.glob("*/*/entry.json")
+    entry_file.write_bytes(entry_file.read_bytes()[:10])
+    other_cache = FilePretrainedLargeModelCache(cache_path)
+    with pytest.raises(ResponseNotFound):
+        other_cache.try_load_response(query, "test-model")
+    other_cache.save(query, "test-model", Response("Hi again!", {"tokens": 5}))
+    other_cache = FilePretrainedLargeModelCache(cache_path)
+    assert other_cache.try_load_response(query, "test-model").text == "Hi again!"
+
+
+def test_file_cache_memory():
+    """Tests the in-memory layer of FilePretrainedLargeModelCache()."""
+    cache_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+    cache_path = Path(cache_dir.name)
+    cache = FilePretrainedLargeModelCache(cache_path, max_memory_entries=1)
+    query1, query2 = Query("Hello!"), Query("Goodbye!")
+    cache.save(query1, "test-model", Response("Hi there!", {}))
+    cache.save(query2, "test-model", Response("See you!", {}))
+
+    # Remove everything on disk so that only the memory layer remains.
+    for entry_file in cache_path.glob("*/*/entry.json"):
+        entry_file.unlink()
+    assert cache.try_load_response(query2, "test-model").text == "See you!"
+    # The first query was evicted from memory.
+    with pytest.raises(ResponseNotFound):
+        cache.try_load_response(query1, "test-model")
+
+
+def test_file_cache_returns_copies():
+    """Tests that mutating a loaded response does not change the cache."""
+    cache_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+    cache_path = Path(cache_dir.name)
+    for max_pending in [1, 10]:
+        cache = FilePretrainedLargeModelCache(cache_path, max_pending=max_pending)
+        query = Query(f"Hello {max_pending}!")
+        response = Response("Hi there!", {"tokens": 1})
+        cache.save(query, "test-model", response)
+        response.metadata["tokens"] = 99
+        loaded_response = cache.try_load_response(query, "test-model")
+        assert loaded_response.metadata == {"tokens": 1}
+        loaded_response.metadata["tokens"] = 999
+        assert cache.try_load_response(query, "test-model").metadata == {"tokens": 1}
+        cache.flush()
+        # Responses loaded from disk are also remembered as copies.
+        other_cache = FilePretrainedLargeModelCache(cache_path)
+        other_cache.try_load_response(query, "test-model").metadata["tokens"] = 9
+        assert other_cache.try_load_response(query, "test-model").metadata == {
+            "tokens": 1
+        }
+
+
+def test_file_cache_with_images():
+    """Tests for FilePretrainedLargeModelCache() with image queries."""
+    cache_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+    cache_path = Path(cache_dir.name)
+    cache = FilePretrainedLargeModelCache(cache_path)
+    imgs = [PIL.Image.new("RGB", (8, 8), "red"), PIL.Image.new("RGBA", (8, 8))]
+    query = Query("Describe these images.", imgs=imgs)
+    cache.save(query, "test-model", Response("Red and clear.", {}))
+    assert cache.try_load_response(query, "test-model").text == "Red and clear."
+    img_paths = sorted(p.name for p in cache_path.glob("*/*/imgs/*"))
+    assert img_paths == ["0.jpg", "1.jpg"]
+
+
+def test_file_cache_flush():
+    """Tests that FilePretrainedLargeModelCache() defers writes until flush."""
+    cache_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+    cache_path = Path(cache_dir.name)
+    cache = FilePretrainedLargeModelCache(
+        cache_path, max_pending=10, flush_interval=float("inf")
+    )
+    query = Query("Hello!")
+    response = Response("Hi there!", {"tokens": 5})
+
+    # Pending responses can be loaded, but are not yet visible on disk.
+    cache.save(query, "test-model", response)
+    assert cache.try_load_response(query, "test-model").text == "Hi there!"
+    other_cache = FilePretrainedLargeModelCache(cache_path)
+    with pytest.raises(ResponseNotFound):
+        other_cache.try_load_response(query, "test-model")
+
+    # After flushing, the response is visible to other caches.
+    cache.flush()
+    assert other_cache.try_load_response(query, "test-model").text == "Hi there!"
+
+    # The exit hook does not keep the cache alive.
+    cache_ref = weakref.ref(cache)
+    del cache
+    gc.collect()
+    assert cache_ref() is None
+
+
+def test_file_cache_without_orjson(monkeypatch):
+    """Tests that FilePretrainedLargeModelCache() falls back to stdlib json."""
+    monkeypatch.setattr(cache_module, "_HAS_ORJSON", False)
+    cache_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+    cache_path = Path(cache_dir.name)
+    cache = FilePretrainedLargeModelCache(cache_path)
+    query = Query("Hello!")
+    cache.save(query, "test-model", Response("Hi there!", {"tokens": 5}))
+    loaded_response = cache.try_load_response(query, "test-model")
+    assert loaded_response.text == "Hi there!"
+    assert loaded_response.metadata["tokens"] == 5
+
+
+def test_json_with_and_without_orjson(monkeypatch):
+    """Tests that orjson and stdlib json save the same metadata."""
+    metadata = {"nan": float("nan"), "inf": float("inf"), "big": 2**70, "none": None}
+    outputs = []
+    for has_orjson in [True, False]:
+        monkeypatch.setattr(cache_module, "_HAS_ORJSON", has_orjson)
+        cache_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+        cache_path = Path(cache_dir.name)
+        cache = FilePretrainedLargeModelCache(cache_path)
+        query = Query("Hello!")
+        cache.save(query, "test-model", Response("Hi there!", metadata))
+        (entry_file,) = cache_path.glob("*/*/entry.json")
+        outputs.append(entry_file.read_bytes())
+        other_cache = FilePretrainedLargeModelCache(cache_path)
+        loaded_metadata = other_cache.try_load_response(query, "test-model").metadata
+        assert math.isnan(loaded_metadata["nan"])
+        assert loaded_metadata["inf"] == float("inf")
+        assert loaded_metadata["big"] == 2**70
+        assert loaded_metadata["none"] is None
+    assert outputs[0] == outputs[1]
+
+
 def test_sqlite_cache():
     """Tests for SQLite3PretrainedLargeModelCache()."""
     cache_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
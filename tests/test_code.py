@@ -1,15 +1,20 @@
 """Tests for code.py."""
 
+import sys
 import tempfile
+import time
 from pathlib import Path
 
 import pytest
 
+from prpl_llm_utils import code as code_module
 from prpl_llm_utils.cache import FilePretrainedLargeModelCache
 from prpl_llm_utils.code import (
     FunctionOutputRepromptCheck,
     SyntaxRepromptCheck,
     SynthesizedPythonFunction,
+    SynthesizedPythonFunctionRunError,
+    parse_python_code_from_text,
     synthesize_python_function_with_llm,
 )
 from prpl_llm_utils.models import OpenAIModel, OrderedResponseModel
@@ -41,6 +46,129 @@ def count_cute_dogs(dog_names: list[str]) -> int:
     assert synthesized_python_fn.run(["nomsy", "puddles"]) == 2
 
 
+def test_synthesized_python_function_run_many(monkeypatch):
+    """Tests for SynthesizedPythonFunction().run_many()."""
+    monkeypatch.setattr(code_module, "_MAX_PARALLEL_RUNS", 4)
+
+    code_str = """
+import time
+
+def slow_double(x: int) -> int:
+    if x < 0:
+        raise ValueError("Negative!")
+    time.sleep(0.5)
+    return 2 * x
+"""
+
+    synthesized_python_fn = SynthesizedPythonFunction(
+        "slow_double", code_str, memoize=True
+    )
+    start_time = time.perf_counter()
+    outputs = list(synthesized_python_fn.run_many([(1,), (2,), (3,), (4,)]))
+    assert outputs == [2, 4, 6, 8]
+    # The inputs should run in parallel.
+    assert time.perf_counter() - start_time < 1.5
+    # Memoized outputs are reused and failures are raised in order.
+    outputs = synthesized_python_fn.run_many([(1,), (-1,), (5,)])
+    assert next(outputs) == 2
+    with pytest.raises(SynthesizedPythonFunctionRunError) as e:
+        next(outputs)
+    assert "Negative!" in str(e)
+    # With fewer parallel runs, each timeout starts when its run starts.
+    monkeypatch.setattr(code_module, "_MAX_PARALLEL_RUNS", 1)
+    synthesized_python_fn = SynthesizedPythonFunction(
+        "slow_double", code_str, timeout=1.0
+    )
+    start_time = time.perf_counter()
+    outputs = list(synthesized_python_fn.run_many([(1,), (2,), (3,)]))
+    assert outputs == [2, 4, 6]
+    assert time.perf_counter() - start_time > 1.5
+
+
+def test_synthesized_python_function_memoize():
+    """Tests memoization in SynthesizedPythonFunction()."""
+
+    # Each run happens in a new process, so the process ID reveals reruns.
+    code_str = """
+import os
+
+def get_pid(x: int) -> list[int]:
+    return [os.getpid()]
+"""
+
+    synthesized_python_fn = SynthesizedPythonFunction("get_pid", code_str, memoize=True)
+    pid = synthesized_python_fn.run(1)
+    assert synthesized_python_fn.run(1) == pid
+    # Unhashable inputs are also memoized.
+    assert synthesized_python_fn.run([1]) == synthesized_python_fn.run([1])
+    # Inputs that are equal but different are not confused.
+    assert synthesized_python_fn.run(True) != pid
+    # Outputs are copies, so mutating them does not change later outputs.
+    synthesized_python_fn.run(1).append(123)
+    assert synthesized_python_fn.run(1) == pid
+    # Outputs are shared between functions with the same code.
+    synthesized_python_fn = SynthesizedPythonFunction("get_pid", code_str, memoize=True)
+    assert synthesized_python_fn.run(1) == pid
+    # Memoization is off by default.
+    synthesized_python_fn = SynthesizedPythonFunction("get_pid", code_str)
+    assert synthesized_python_fn.run(1) != synthesized_python_fn.run(1)
+
+
+def test_synthesized_python_function_missing_import():
+    """Tests that code with a missing import fails like it would elsewhere."""
+
+    code_str = """
+def get_area(radius: float) -> float:
+    return math.pi * radius**2
+"""
+
+    synthesized_python_fn = SynthesizedPythonFunction("get_area", code_str)
+    with pytest.raises(SynthesizedPythonFunctionRunError) as e:
+        synthesized_python_fn.run(1.0)
+    assert "NameError" in str(e)
+
+
+def test_synthesized_module_eviction(monkeypatch):
+    """Tests that evicted synthesized modules are removed from sys.modules."""
+    monkeypatch.setattr(code_module, "_MAX_SYNTHESIZED_MODULES", 1)
+
+    code_str = """
+from dataclasses import dataclass
+
+@dataclass
+class Point:
+
+    x: int
+
+
+def make_point(x: int) -> Point:
+    return Point(x)
+"""
+
+    fn1 = SynthesizedPythonFunction("make_point", code_str)
+    fn2 = SynthesizedPythonFunction("f", "def f():\n    return 2\n")
+    assert fn1.run(1).x == 1
+    module_name = fn1._fn.__module__  # pylint: disable=protected-access
+    assert module_name in sys.modules
+    assert fn2.run() == 2
+    assert module_name not in sys.modules
+    # Functions from evicted modules still work, including when they return
+    # instances of classes defined in the synthesized code.
+    assert fn1.run(3).x == 3
+    assert module_name in sys.modules
+
+
+def test_parse_python_code_from_text():
+    """Tests for parse_python_code_from_text()."""
+    text = "Here you go:\n```python\nx = 1\n```\nMore text.\n```\ny = 2\n```"
+    assert parse_python_code_from_text(text) == "\nx = 1\n"
+    # Missing closing fence.
+    assert parse_python_code_from_text("```python\nx = 1\n") == "\nx = 1\n"
+    # Missing opening fence.
+    assert parse_python_code_from_text("```\nx = 1\n```") is None
+    assert parse_python_code_from_text("No code here.") is None
+
+
 def test_synthesize_python_function_with_llm():
     """Tests for synthesize_python_function_with_llm()."""
     cache_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
@@ -1,12 +1,21 @@
 """Tests for the large language model interface."""
 
+import asyncio
+import json
 import tempfile
 from pathlib import Path
+from types import SimpleNamespace
 
+import openai
 import pytest
 
 from prpl_llm_utils.cache import FilePretrainedLargeModelCache
-from prpl_llm_utils.models import CannedResponseModel, OpenAIModel
+from prpl_llm_utils.models import (
+    AsyncOpenAIModel,
+    BatchedOpenAIModel,
+    CannedResponseModel,
+    OpenAIModel,
+)
 from prpl_llm_utils.structs import Query, Response
 
 runllms = pytest.mark.skipif("not config.getoption('runllms')")
@@ -34,6 +43,216 @@ def test_canned_response_model():
     assert "No cached response found for prompt." in str(e)
 
 
+def test_run_queries():
+    """Tests for run_queries()."""
+    canned_responses = {
+        Query("Hello!"): Response("Hi!", {}),
+        Query("What's up?"): Response("Nothing much.", {}),
+    }
+    cache_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+    cache_path = Path(cache_dir.name)
+    cache = FilePretrainedLargeModelCache(cache_path)
+    llm = CannedResponseModel(canned_responses, cache)
+    assert llm.query("Hello!").text == "Hi!"
+    queries = [Query("What's up?"), Query("Hello!"), Query("What's up?")]
+    responses = llm.run_queries(queries)
+    assert [r.text for r in responses] == ["Nothing much.", "Hi!", "Nothing much."]
+    llm = CannedResponseModel(canned_responses, cache, use_cache_only=True)
+    assert [r.text for r in llm.run_queries(queries)] == [r.text for r in responses]
+    with pytest.raises(ValueError) as e:
+        llm.run_queries([Query("Hello!"), Query("Hi!")])
+    assert "No cached response found for prompt." in str(e)
+    # Successful responses are cached even if other queries fail.
+    canned_responses[Query("Good morning!")] = Response("Morning!", {})
+    llm = CannedResponseModel(canned_responses, cache)
+    with pytest.raises(RuntimeError) as e:
+        llm.run_queries([Query("Hi!"), Query("Good morning!")])
+    assert "1 of 2 queries" in str(e) and "'Hi!'" in str(e)
+    assert isinstance(e.value.__cause__, KeyError)
+    llm = CannedResponseModel(canned_responses, cache, use_cache_only=True)
+    assert llm.query("Good morning!").text == "Morning!"
+
+
+def _make_completion_body(text):
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-4o-mini",
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": text},
+            }
+        ],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    }
+
+
+class _StubClient:
+    """Stands in for openai.OpenAI() and counts how many are created."""
+
+    num_created = 0
+
+    def __init__(self):
+        type(self).num_created += 1
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, messages, model):
+        del model
+        return openai.types.chat.ChatCompletion.model_validate(
+            _make_completion_body(messages[0]["content"].upper())
+        )
+
+
+def test_openai_model_reuses_client(monkeypatch):
+    """Tests that OpenAIModel() creates one client for all of its queries."""
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setattr(openai, "OpenAI", _StubClient)
+    monkeypatch.setattr(_StubClient, "num_created", 0)
+    cache_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+    cache_path = Path(cache_dir.name)
+    cache = FilePretrainedLargeModelCache(cache_path)
+    llm = OpenAIModel("gpt-4o-mini", cache)
+    assert llm.query("a").text == "A"
+    assert llm.query("b").text == "B"
+    assert _StubClient.num_created == 1
+
+
+class _StubBatchClient:
+    """Stands in for openai.OpenAI() in the batch tests."""
+
+    def __init__(self, output_lines, error_lines):
+        self.uploaded = b""
+        self.files = SimpleNamespace(create=self._create_file, content=self._content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._get)
+        self._contents = {
+            "output": "\n".join(json.dumps(line) for line in output_lines),
+            "errors": "\n".join(json.dumps(line) for line in error_lines),
+        }
+
+    def _create_file(self, file, purpose):
+        assert purpose == "batch"
+        self.uploaded = file[1]
+        return SimpleNamespace(id="input")
+
+    def _content(self, file_id):
+        return SimpleNamespace(text=self._contents[file_id])
+
+    def _create_batch(self, input_file_id, endpoint, completion_window):
+        del completion_window
+        assert input_file_id == "input"
+        assert endpoint == "/v1/chat/completions"
+        return SimpleNamespace(id="batch", status="in_progress")
+
+    def _get(self, batch_id):
+        return SimpleNamespace(
+            id=batch_id,
+            status="completed",
+            output_file_id="output",
+            error_file_id="errors",
+        )
+
+
+def test_batched_openai_model(monkeypatch):
+    """Tests for BatchedOpenAIModel() with a stub client."""
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    # The results come back out of order, and one request failed.
+    output_lines = [
+        {
+            "custom_id": "2",
+            "response": {"status_code": 200, "body": _make_completion_body("C")},
+            "error": None,
+        },
+        {
+            "custom_id": "0",
+            "response": {"status_code": 200, "body": _make_completion_body("A")},
+            "error": None,
+        },
+    ]
+    error_lines = [
+        {
+            "custom_id": "1",
+            "response": {"status_code": 400, "body": {"error": "Bad request."}},
+            "error": None,
+        },
+    ]
+    client = _StubBatchClient(output_lines, error_lines)
+    cache_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+    cache_path = Path(cache_dir.name)
+    cache = FilePretrainedLargeModelCache(cache_path)
+    llm = BatchedOpenAIModel("gpt-4o-mini", cache, poll_interval=0.0)
+    monkeypatch.setattr(llm, "_client", client)
+    queries = [Query("A?"), Query("B?"), Query("C?", hyperparameters={"seed": 1})]
+    with pytest.raises(RuntimeError) as e:
+        llm.run_queries(queries)
+    assert "1 of 3 queries" in str(e) and "Bad request." in str(e)
+    requests = [json.loads(line) for line in client.uploaded.decode().splitlines()]
+    assert [r["custom_id"] for r in requests] == ["0", "1", "2"]
+    assert requests[2]["url"] == "/v1/chat/completions"
+    assert requests[2]["body"]["messages"][0]["content"] == "C?"
+    assert requests[2]["body"]["seed"] == 1
+    # The successful responses were cached.
+    llm = BatchedOpenAIModel("gpt-4o-mini", cache, use_cache_only=True)
+    assert [r.text for r in llm.run_queries([queries[0], queries[2]])] == ["A", "C"]
+
+
+class _StubAsyncClient:
+    """Stands in for openai.AsyncOpenAI() in the async tests."""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return None
+
+    async def _create(self, messages, model):
+        del model
+        prompt = messages[0]["content"]
+        if prompt == "Fail!":
+            raise ValueError("Failed!")
+        await asyncio.sleep(0)
+        return openai.types.chat.ChatCompletion.model_validate(
+            _make_completion_body(prompt.upper())
+        )
+
+
+def test_async_openai_model_with_stub_client(monkeypatch):
+    """Tests AsyncOpenAIModel() with a stub client."""
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setattr(openai, "AsyncOpenAI", _StubAsyncClient)
+    cache_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+    cache_path = Path(cache_dir.name)
+    cache = FilePretrainedLargeModelCache(cache_path)
+    llm = AsyncOpenAIModel("gpt-4o-mini", cache, max_concurrent_queries=2)
+    responses = llm.run_queries([Query("a"), Query("b"), Query("c")])
+    assert [r.text for r in responses] == ["A", "B", "C"]
+    with pytest.raises(RuntimeError) as e:
+        llm.run_queries([Query("Fail!"), Query("d")])
+    assert "1 of 2 queries" in str(e) and "Failed!" in str(e)
+
+    # This also works when an event loop is already running, as in Jupyter.
+    async def _run_in_loop():
+        return llm.run_queries([Query("e")])
+
+    assert [r.text for r in asyncio.run(_run_in_loop())] == ["E"]
+
+
+def test_uncached_query_returns_model_response():
+    """Tests that a fresh response is returned without a cache round trip."""
+    query = Query("Hello!")
+    response = Response("Hi!", {})
+    cache_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+    cache_path = Path(cache_dir.name)
+    cache = FilePretrainedLargeModelCache(cache_path)
+    llm = CannedResponseModel({query: response}, cache)
+    assert llm.run_query(query) is response
+
+
 @runllms
 def test_openai_model():
     """Tests for OpenAIModel()."""
@@ -50,3 +269,17 @@ def test_openai_model():
     with pytest.raises(ValueError) as e:
         llm.query("What's up?")
     assert "No cached response found for prompt." in str(e)
+
+
+@runllms
+def test_async_openai_model():
+    """Tests for AsyncOpenAIModel()."""
+    cache_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+    cache_path = Path(cache_dir.name)
+    cache = FilePretrainedLargeModelCache(cache_path)
+    llm = AsyncOpenAIModel("gpt-4o-mini", cache)
+    queries = [Query("Hello!"), Query("What's up?")]
+    responses = llm.run_queries(queries)
+    assert len(responses) == 2
+    llm = AsyncOpenAIModel("gpt-4o-mini", cache, use_cache_only=True)
+    assert [r.text for r in llm.run_queries(queries)] == [r.text for r in responses]
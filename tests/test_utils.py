@@ -0,0 +1,18 @@
+"""Tests for utils.py."""
+
+from prpl_llm_utils.utils import consistent_hash
+
+
+def test_consistent_hash():
+    """Tests for consistent_hash()."""
+    obj = ("Hello!", (), ("seed", 1))
+    assert consistent_hash(obj) == consistent_hash(("Hello!", (), ("seed", 1)))
+    assert consistent_hash(obj) != consistent_hash(("Hello!", (), ("seed", 2)))
+    # Different structures with the same contents should not collide.
+    assert consistent_hash(("a", "b")) != consistent_hash(("ab",))
+    assert consistent_hash(("a", "b")) != consistent_hash(["a", "b"])
+    assert consistent_hash((1,)) != consistent_hash(("1",))
+    assert consistent_hash((1,)) != consistent_hash((True,))
+    # The output should be in the same range as hash().
+    for i in range(100):
+        assert -(2**63) <= consistent_hash(i) < 2**63